@@ -0,0 +1,46 @@
+import os
+import argparse
+import logging
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from data_sources import era5
+
+load_dotenv() # development (API keys)
+
+parser = argparse.ArgumentParser(
+    description=('Download the ERA5 data of a range of timestamps into '
+                 'TARGET_FOLDER/era5_raw, using as few CDS requests as possible.'))
+parser.add_argument('--start', required=True,
+                    help='First timestamp (UTC), e.g. 2025-01-01T00:00.')
+parser.add_argument('--end', required=True,
+                    help='Last timestamp (UTC, included), e.g. 2025-01-31T18:00.')
+parser.add_argument('--step-hours', type=int, required=False, default=6,
+                    dest='step_hours',
+                    help='Hours between two timestamps. Default is 6.')
+parser.add_argument('-t', '--target-folder',
+                    required=False, default='./data',
+                    dest='target_folder',
+                    help='Target folder, as used with main.py.')
+parser.add_argument('--cache-folder', required=False, default=None,
+                    dest='cache_folder',
+                    help='Download cache folder. Default is TARGET_FOLDER/cache.')
+
+args = parser.parse_args()
+
+logging.getLogger('ecmwf.datastores.legacy_client').propagate = False
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s %(message)s',
+    force=True
+)
+
+start = datetime.fromisoformat(args.start).replace(tzinfo=timezone.utc)
+end = datetime.fromisoformat(args.end).replace(tzinfo=timezone.utc)
+datetimes = []
+while start <= end:
+    datetimes.append(start)
+    start += timedelta(hours=args.step_hours)
+
+era5.download(os.path.join(args.target_folder, 'era5_raw'),
+              args.cache_folder or os.path.join(args.target_folder, 'cache'),
+              datetimes)
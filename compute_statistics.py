@@ -0,0 +1,25 @@
+import argparse
+import logging
+import processing
+
+parser = argparse.ArgumentParser(
+    description=('Compute the per-variable, per-level mean and std of an '
+                 'archive of processed zarr stores, for use with '
+                 'main.py --statistics.'))
+parser.add_argument('-p', '--processed-folder',
+                    required=False, default='./data/processed',
+                    dest='processed_folder',
+                    help='Folder containing the processed (unnormalised) zarr stores.')
+parser.add_argument('-o', '--output',
+                    required=False, default='./data/statistics.nc',
+                    help='Destination NetCDF4 file of the statistics.')
+
+args = parser.parse_args()
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s %(message)s',
+    force=True
+)
+
+processing.compute_statistics(args.processed_folder, args.output)
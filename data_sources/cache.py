@@ -0,0 +1,176 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Callable
+import fasteners
+from contextlib import contextmanager
+
+COMPLETE_MARKER = '.complete'
+
+# fasteners' locks are held per process, so threads of a same process also need
+# to be serialised between themselves.
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+def fetch(cache_folder: str,
+          source: str,
+          request: dict,
+          dt: datetime,
+          download: Callable[[str], None],
+          target: str) -> list[str]:
+    '''
+    Get the files produced by `download` for (`source`, `request`, `dt`) from
+    the shared cache, downloading them only if no other process (or thread) has
+    done so yet, and make them available in the `target` folder.
+
+    Concurrent callers asking for the same artefact wait for the one in-flight
+    download instead of repeating it. Downloads are done in a temporary folder
+    that is renamed into the cache once complete, so that an interrupted
+    download never leaves a partial entry behind. The files are linked into
+    `target` under the entry's lock, so `evict` cannot remove them in between;
+    the links then remain valid once the entry is evicted.
+
+    Parameters:
+        cache_folder (str): The shared cache folder.
+        source (str): Name of the data source (e.g. `era5`).
+        request (dict): The request sent to the source. Must be JSON-serialisable
+            (with the exception of datetimes).
+        dt (datetime): The date and time of the requested data.
+        download (Callable[[str], None]): Downloads the artefact into the given
+            (empty) folder.
+        target (str): The folder in which to place the cached files.
+    Returns:
+        list[str]: The paths of the files in `target`.
+    '''
+    logger = logging.getLogger(__name__)
+
+    key = _cache_key(source, request, dt)
+    source_folder = os.path.join(cache_folder, source)
+    entry = os.path.join(source_folder, key)
+
+    with _entry_lock(entry):
+        if os.path.exists(os.path.join(entry, COMPLETE_MARKER)):
+            logger.info(f'Using cached {source} data for {dt} ({key})')
+        else:
+            logger.info(f'Downloading {source} data for {dt} into the cache ({key})')
+            tmp = tempfile.mkdtemp(prefix=f'.{key}-', dir=source_folder)
+            try:
+                download(tmp)
+                open(os.path.join(tmp, COMPLETE_MARKER), 'w').close()
+                if os.path.exists(entry): # left over by an interrupted run
+                    shutil.rmtree(entry)
+                os.rename(tmp, entry)
+            except BaseException:
+                shutil.rmtree(tmp, ignore_errors=True)
+                raise
+
+        os.makedirs(target, exist_ok=True)
+        paths = []
+        for name in sorted(os.listdir(entry)):
+            if name == COMPLETE_MARKER:
+                continue
+            path = os.path.join(target, name)
+            _link_atomic(os.path.join(entry, name), path)
+            paths.append(path)
+        return paths
+
+def evict(cache_folder: str, max_age: float) -> int:
+    '''
+    Remove the cache entries downloaded more than `max_age` seconds ago, along
+    with their lock files. Each entry is removed under its lock, so that no
+    concurrent run is downloading it or linking from it at the same time.
+    `evict(cache_folder, 0)` empties the cache.
+
+    Returns:
+        int: The number of removed entries.
+    '''
+    logger = logging.getLogger(__name__)
+    if not os.path.exists(cache_folder):
+        return 0
+
+    removed = 0
+    for source in os.listdir(cache_folder):
+        source_folder = os.path.join(cache_folder, source)
+        # Every entry, complete or not, has a lock file
+        for name in os.listdir(source_folder):
+            if not name.endswith('.lock'):
+                continue
+            entry = os.path.join(source_folder, name[:-len('.lock')])
+            with _entry_lock(entry, create=False) as locked:
+                if not locked:
+                    continue
+                # The age is checked once locked, as the entry may have been
+                # downloaded while waiting
+                marker = os.path.join(entry, COMPLETE_MARKER)
+                if os.path.exists(marker) and os.stat(marker).st_mtime > time.time() - max_age:
+                    continue
+                if os.path.exists(entry):
+                    shutil.rmtree(entry)
+                    removed += 1
+                # Safe under the lock: waiters notice the file is gone (see
+                # `_entry_lock`) and lock a new one.
+                os.remove(f'{entry}.lock')
+    if removed:
+        logger.info(f'Evicted {removed} entries older than {max_age:.0f}s from {cache_folder}')
+    return removed
+
+@contextmanager
+def _entry_lock(entry: str, create: bool = True):
+    '''
+    Hold the thread and inter-process locks of a cache entry. Yields False
+    without locking if `create` is False and the lock file does not exist.
+
+    As `evict` removes lock files, a lock acquired on a file that has been
+    removed (or replaced) in the meantime is not held by anyone else: it is
+    released and the lock is taken again on the current file.
+    '''
+    lock_path = f'{entry}.lock'
+    with _thread_lock(entry):
+        while True:
+            if not create and not os.path.exists(lock_path):
+                yield False
+                return
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            lock = fasteners.InterProcessLock(lock_path)
+            lock.acquire()
+            try:
+                current = os.stat(lock_path).st_ino
+            except FileNotFoundError:
+                current = None
+            if current == os.fstat(lock.lockfile.fileno()).st_ino:
+                break
+            lock.release()
+        try:
+            yield True
+        finally:
+            lock.release()
+
+def _cache_key(source: str, request: dict, dt: datetime) -> str:
+    description = json.dumps(
+        {'source': source, 'request': request, 'datetime': dt.isoformat()},
+        sort_keys=True,
+        default=str
+    )
+    return hashlib.sha256(description.encode()).hexdigest()[:32]
+
+def _thread_lock(entry: str) -> threading.Lock:
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(entry, threading.Lock())
+
+def _link_atomic(src: str, dst: str) -> None:
+    '''
+    Hardlink (or copy, across filesystems) `src` to `dst` through a temporary
+    name, so that `dst` is never seen partially written.
+    '''
+    tmp = f'{dst}.{os.getpid()}-{threading.get_ident()}.tmp'
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
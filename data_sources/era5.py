@@ -5,10 +5,53 @@ import os
 import requests
 import cdsapi
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
 import zipfile
+import shutil
+import tempfile
+import xarray as xr
+from . import cache
 
-def download_latest(target: str) -> datetime:
+PRESSURE_DATASET = "reanalysis-era5-pressure-levels"
+SINGLE_DATASET = "reanalysis-era5-single-levels"
+
+# The selected variables are the same as in the APPA paper.
+PRESSURE_VARIABLES = [
+    "geopotential",
+    "specific_humidity",
+    "temperature",
+    "u_component_of_wind",
+    "v_component_of_wind"
+]
+PRESSURE_LEVELS = [
+    "50", "100", "150",
+    "200", "250", "300",
+    "400", "500", "600",
+    "700", "850", "925",
+    "1000"
+]
+SINGLE_VARIABLES = [
+    "10m_u_component_of_wind",
+    "10m_v_component_of_wind",
+    "2m_temperature",
+    "mean_sea_level_pressure",
+    "sea_surface_temperature",
+    "total_precipitation"
+]
+
+# Maximum number of fields (timestamps x variables x levels) in a single CDS
+# request. Larger requests are rejected by the CDS as too costly.
+MAX_FIELDS = {
+    PRESSURE_DATASET: 60000,
+    SINGLE_DATASET: 120000,
+}
+
+# Number of requests queued on the CDS at the same time.
+MAX_CONCURRENT_REQUESTS = 4
+
+def download_latest(target: str, cache_folder: str) -> datetime:
     '''
     Download the latest relevant files given by the era5 model.
     In order for this function to work, a CDS API key must be provided as an
@@ -16,114 +59,183 @@ def download_latest(target: str) -> datetime:
         
     Parameters:
         target (str): The target output **folder**.
+        cache_folder (str): The download cache folder, which can be shared
+            between concurrent runs (see `cache.fetch`).
     Returns:
         datetime: The date and time of the downloaded data
     '''
-    
-    CDS_API_KEY = os.environ['CDS_API_KEY']
-    
-    # Save the API key (env var) to the ~/.cdsapirc file (as required by the spec)
-    with open(os.path.expandvars("$HOME/.cdsapirc"), "w+") as f:
-        f.write(f'url: https://cds.climate.copernicus.eu/api\nkey: {CDS_API_KEY}')
-    
     dt = _latest_datetime()
     
     logger = logging.getLogger(__name__)
     logger.info(f'Found latest datetime: {dt}')
-    logger.info(f'Downloading pressure levels for {dt}...')
-    _download_pressure_levels(target, dt)
-    logger.info(f'Downloading single levels for {dt}...')
-    _download_single_levels(target, dt)
+    download(target, cache_folder, [dt])
     return dt
 
-def _download_pressure_levels(target: str, dt: datetime):
+def download(target: str,
+             cache_folder: str,
+             datetimes: list[datetime],
+             client: cdsapi.Client | None = None) -> None:
     '''
-    Download the latest pressure levels. See
-    [here](https://cds.climate.copernicus.eu/datasets/reanalysis-era5-pressure-levels)
-    for more info. The selected variables are the same as in the APPA paper.
-    
-    Will not work if called externally (requires the API key to first be stored).
+    Download the pressure and single levels of all the given `datetimes`, using
+    as few CDS requests as possible (see `plan_requests`). The requests are
+    submitted concurrently, and their results are split back into one
+    `{dt}-pressure.nc` and one `{dt}-single.nc` file per timestamp in `target`.
+    Unless a `client` is given, the CDS API key is read from the CDS_API_KEY
+    environment variable (see `download_latest`).
+
+    Parameters:
+        target (str): The target output **folder**.
+        cache_folder (str): The download cache folder.
+        datetimes (list[datetime]): The (UTC) timestamps to download.
+        client (cdsapi.Client | None): The client to submit requests with.
+            Defaults to a new `cdsapi.Client` per request.
     '''
-    
-    dataset = "reanalysis-era5-pressure-levels"
-    request = {
-        "product_type": ["reanalysis"],
-        "variable": [
-            "geopotential",
-            "specific_humidity",
-            "temperature",
-            "u_component_of_wind",
-            "v_component_of_wind"
-        ],
-        "year": [dt.year],
-        "month": [dt.month],
-        "day": [dt.day],
-        "time": [dt.strftime("%H:%M:%S")],
-        "pressure_level": [
-            "50", "100", "150",
-            "200", "250", "300",
-            "400", "500", "600",
-            "700", "850", "925",
-            "1000"
-        ],
-        "data_format": "netcdf",
-        "download_format": "zip"
-    }
-
-    path = os.path.join(target, f'{dt.strftime("%Y-%m-%dT%H:%M:%SZ")}-pressure.zip')
-
-    client = cdsapi.Client()
-    client.retrieve(dataset, request).download(target=path)
-    
-    filename_in_zip = 'data_stream-oper_stepType-instant.nc'
-    
-    with zipfile.ZipFile(path, 'r') as z:
-        z.extract(filename_in_zip,
-                  path=target)
-    
-    os.rename(os.path.join(target, filename_in_zip), os.path.splitext(path)[0] + '.nc')
+    logger = logging.getLogger(__name__)
+
+    if client is None:
+        _store_api_key()
+
+    jobs = []
+    for dataset, suffix in [(PRESSURE_DATASET, 'pressure'), (SINGLE_DATASET, 'single')]:
+        for request in plan_requests(dataset, datetimes):
+            jobs.append((dataset, request, suffix))
+    logger.info(f'Downloading {len(datetimes)} timestamps in {len(jobs)} CDS requests')
 
-def _download_single_levels(target: str, dt: datetime):
+    os.makedirs(target, exist_ok=True)
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        futures = [
+            executor.submit(_retrieve, dataset, request, target, cache_folder, client)
+            for dataset, request, _ in jobs
+        ]
+        try:
+            # The netCDF library is not thread-safe, so results are split from
+            # this thread only, as they come in.
+            for future, (_, _, suffix) in zip(futures, jobs):
+                path = future.result()
+                try:
+                    _split(path, suffix, target)
+                finally:
+                    shutil.rmtree(os.path.dirname(path))
+        except BaseException:
+            executor.shutdown(cancel_futures=True)
+            for future in futures:
+                if not future.cancelled() and future.exception() is None:
+                    shutil.rmtree(os.path.dirname(future.result()), ignore_errors=True)
+            raise
+
+def plan_requests(dataset: str, datetimes: list[datetime]) -> list[dict]:
     '''
-    Download the latest single levels. See
-    [here](https://cds.climate.copernicus.eu/datasets/reanalysis-era5-pressure-levels)
-    for more info. The selected variables are the same as in the APPA paper.
-    
-    Will not work if called externally (requires the API key to first be stored).
+    Group `datetimes` into the fewest CDS requests of `dataset`.
+
+    A CDS request selects the product of its years, months, days and times, so
+    timestamps are grouped by month, and within a month, days sharing the same
+    set of hours are requested together (e.g. a whole month at 00 and 12 UTC is
+    one request). Groups larger than `MAX_FIELDS` are split by days. No
+    timestamp outside of `datetimes` is ever requested.
+
+    Returns:
+        list[dict]: The CDS requests.
     '''
+    variables = PRESSURE_VARIABLES if dataset == PRESSURE_DATASET else SINGLE_VARIABLES
+    fields_per_timestamp = len(variables)
+    if dataset == PRESSURE_DATASET:
+        fields_per_timestamp *= len(PRESSURE_LEVELS)
 
-    dataset = "reanalysis-era5-single-levels"
-    request = {
-        "product_type": ["reanalysis"],
-        "variable": [
-            "10m_u_component_of_wind",
-            "10m_v_component_of_wind",
-            "2m_temperature",
-            "mean_sea_level_pressure",
-            "sea_surface_temperature",
-            "total_precipitation"
-        ],
-        "year": [dt.year],
-        "month": [dt.month],
-        "day": [dt.day],
-        "time": [dt.strftime("%H:%M:%S")],
-        "data_format": "netcdf",
-        "download_format": "zip"
-    }
-
-    path = os.path.join(target, f'{dt.strftime("%Y-%m-%dT%H:%M:%SZ")}-single.zip')
-
-    client = cdsapi.Client()
-    client.retrieve(dataset, request).download(target=path)
-    
-    filename_in_zip = 'data_stream-oper_stepType-instant.nc'
-    
-    with zipfile.ZipFile(path, 'r') as z:
-        z.extract(filename_in_zip,
-                  path=target)
+    # (year, month) -> day -> hours
+    months = defaultdict(lambda: defaultdict(set))
+    for dt in datetimes:
+        dt = dt.astimezone(timezone.utc) if dt.tzinfo else dt
+        months[(dt.year, dt.month)][dt.day].add(dt.strftime("%H:%M:%S"))
+
+    planned = []
+    for (year, month), days in sorted(months.items()):
+        # hours -> days
+        blocks = defaultdict(list)
+        for day, hours in sorted(days.items()):
+            blocks[tuple(sorted(hours))].append(day)
+
+        for hours, block_days in blocks.items():
+            days_per_request = max(
+                MAX_FIELDS[dataset] // (fields_per_timestamp * len(hours)), 1)
+            for i in range(0, len(block_days), days_per_request):
+                request = {
+                    "product_type": ["reanalysis"],
+                    "variable": variables,
+                    "year": [year],
+                    "month": [month],
+                    "day": block_days[i:i + days_per_request],
+                    "time": list(hours),
+                    "data_format": "netcdf",
+                    "download_format": "zip"
+                }
+                if dataset == PRESSURE_DATASET:
+                    request["pressure_level"] = PRESSURE_LEVELS
+                planned.append(request)
+    return planned
+
+def _store_api_key():
+    '''
+    Save the API key (env var) to the ~/.cdsapirc file (as required by the spec)
+    '''
+    CDS_API_KEY = os.environ['CDS_API_KEY']
     
-    os.rename(os.path.join(target, filename_in_zip), os.path.splitext(path)[0] + '.nc')
+    with open(os.path.expandvars("$HOME/.cdsapirc"), "w+") as f:
+        f.write(f'url: https://cds.climate.copernicus.eu/api\nkey: {CDS_API_KEY}')
 
+def _retrieve(dataset: str,
+              request: dict,
+              target: str,
+              cache_folder: str,
+              client: cdsapi.Client | None) -> str:
+    '''
+    Retrieve `request` from the CDS through the download cache, and link the
+    result into a new hidden staging folder in `target`. The link stays valid
+    even if the cache entry is evicted before the result is split.
+
+    Returns:
+        str: The path of the staged NetCDF4 file.
+    '''
+    def download(folder: str):
+        path = os.path.join(folder, 'data.zip')
+
+        (client or cdsapi.Client()).retrieve(dataset, request).download(target=path)
+        
+        filename_in_zip = 'data_stream-oper_stepType-instant.nc'
+        
+        with zipfile.ZipFile(path, 'r') as z:
+            z.extract(filename_in_zip,
+                      path=folder)
+        
+        os.rename(os.path.join(folder, filename_in_zip), os.path.join(folder, 'data.nc'))
+        os.remove(path)
+
+    first = datetime(request["year"][0], request["month"][0], request["day"][0],
+                     tzinfo=timezone.utc)
+    staging = tempfile.mkdtemp(prefix='.staging-', dir=target)
+    try:
+        return cache.fetch(cache_folder,
+                           'era5',
+                           {'dataset': dataset, **request},
+                           first,
+                           download,
+                           staging)[0]
+    except BaseException:
+        shutil.rmtree(staging)
+        raise
+
+def _split(path: str, suffix: str, target: str):
+    '''
+    Split the NetCDF4 file of a request into one `{dt}-{suffix}.nc` file per
+    timestamp in `target`.
+    '''
+    os.makedirs(target, exist_ok=True)
+    with xr.open_dataset(path, engine='netcdf4') as ds:
+        for i, valid_time in enumerate(ds.valid_time.values):
+            dt = datetime.fromisoformat(str(valid_time)[:19])
+            dt_path = os.path.join(target, f'{dt.strftime("%Y-%m-%dT%H:%M:%SZ")}-{suffix}.nc')
+            # Keep a valid_time dimension of size 1, as in a single-timestamp request
+            ds.isel(valid_time=[i]).to_netcdf(f'{dt_path}.tmp', engine='netcdf4')
+            os.replace(f'{dt_path}.tmp', dt_path)
 
 def _latest_datetime() -> datetime:
     '''
@@ -12,61 +12,73 @@ import xarray as xr
 import cfgrib
 import logging
 from datetime import datetime, timezone
+from . import cache
 
-def download_latest(target: str) -> datetime:
+REQUEST = {
+    'type': 'fc',
+    'step': 0,
+    'param': [
+        # Single level fields
+        
+        '10u',  # 10 metre U wind component
+        '10v',  # 10 metre V wind component
+        '2t',   # 2 metre temperature
+        'msl',  # Mean sea level pressure
+        #'ro',   # Runoff
+        #'skt',  # Skin temperature
+        #'sp',   # Surface pressure
+        #'st',   # Soil Temperature - Not found?!
+        #'stl1', # Soil temperature level 1 - Not found?!
+        #'tcwv', # Total column vertically-integrated water vapour 	
+        'tp',   # Total Precipitation
+        #'ssr', # Doesn't work
+        
+        # Atmospheric fields on pressure levels
+        
+        #'d',   # Divergence
+        'gh', 	# Geopotential height
+        'q',	# Specific humidity
+        #'r',	# Relative humidity
+        't',	# Temperature 	K
+        'u',	# U component of wind
+        'v',	# V component of wind
+        #'vo', 	# Vorticity (relative)
+    ],
+}
+
+def download_latest(target: str, cache_folder: str) -> datetime:
     '''
     Download the latest relevant files given by the IFS model. No API key is
     required for this model.
         
     Parameters:
         target (str): The target output **folder**.
+        cache_folder (str): The download cache folder, which can be shared
+            between concurrent runs (see `cache.fetch`).
     Returns:
         datetime: The date and time of the downloaded data
     '''
-    data_file = os.path.join(target, 'data.grib2')
     client = Client(model='ifs')
-    result = client.retrieve(
-        type='fc',
-        step=0,
-        param=[
-                # Single level fields
-                
-                '10u',  # 10 metre U wind component
-                '10v',  # 10 metre V wind component
-                '2t',   # 2 metre temperature
-                'msl',  # Mean sea level pressure
-                #'ro',   # Runoff
-                #'skt',  # Skin temperature
-                #'sp',   # Surface pressure
-                #'st',   # Soil Temperature - Not found?!
-                #'stl1', # Soil temperature level 1 - Not found?!
-                #'tcwv', # Total column vertically-integrated water vapour 	
-                'tp',   # Total Precipitation
-                #'ssr', # Doesn't work
-                
-                # Atmospheric fields on pressure levels
-                
-                #'d',   # Divergence
-                'gh', 	# Geopotential height
-                'q',	# Specific humidity
-                #'r',	# Relative humidity
-                't',	# Temperature 	K
-                'u',	# U component of wind
-                'v',	# V component of wind
-                #'vo', 	# Vorticity (relative)
-            ],
-        target=data_file,
-    )
-        
-    iso_format = result.datetime.strftime('%Y-%m-%dT%H:%M:%SZ')
-    os.rename(data_file, os.path.join(target, f'{iso_format}.grib2'))
-    data_file = os.path.join(target, f'{iso_format}.grib2')
+    # Resolve the latest cycle first, so that the download can be looked up in
+    # (or shared through) the cache.
+    dt = client.latest(**REQUEST).replace(tzinfo=timezone.utc)
+    iso_format = dt.strftime('%Y-%m-%dT%H:%M:%SZ')
     
-    logger = logging.getLogger(__name__)
-    logger.info('Converting the obtained .grib2 file into NetCDF4')
-    _grib_to_netcdf4(data_file)
+    def download(folder: str):
+        data_file = os.path.join(folder, f'{iso_format}.grib2')
+        client.retrieve(
+            **REQUEST,
+            date=dt.strftime('%Y%m%d'),
+            time=dt.hour,
+            target=data_file,
+        )
+        
+        logger = logging.getLogger(__name__)
+        logger.info('Converting the obtained .grib2 file into NetCDF4')
+        _grib_to_netcdf4(data_file)
     
-    return result.datetime.replace(tzinfo=timezone.utc)
+    cache.fetch(cache_folder, 'ifs', REQUEST, dt, download, target)
+    return dt
 
 def _grib_to_netcdf4(grib_path: str) -> None:
     dss = cfgrib.open_datasets(grib_path, decode_timedelta=True)
@@ -6,6 +6,7 @@ import logging
 import processing
 from custom_data.solar_radiation import xarray_integrated_toa_solar_radiation
 import shutil
+from data_sources import cache
 
 load_dotenv() # development (API keys)
 
@@ -28,6 +29,33 @@ parser.add_argument('-c', '--cleanup', action='store_true',
                           'dataset, keeping only processed files. Using this '
                           'along with --skip-download will download the files '
                           'then immediately delete them.'))
+parser.add_argument('--cache-folder', required=False, default=None,
+                    dest='cache_folder',
+                    help=('Download cache folder, which can be shared between '
+                          'concurrent runs so that each artefact is only '
+                          'downloaded once. Default is TARGET_FOLDER/cache.'))
+parser.add_argument('--cache-max-age', type=float, required=False, default=None,
+                    dest='cache_max_age',
+                    help=('If set, remove the entries of the download cache '
+                          'that are older than this many hours at the end of '
+                          'the run.'))
+parser.add_argument('--no-deduplication', action='store_true',
+                    dest='no_deduplication',
+                    help=('If set, write every chunk of the processed data '
+                          'instead of hardlinking those identical to previous '
+                          'outputs.'))
+parser.add_argument('--s3-url', required=False, default=None,
+                    dest='s3_url',
+                    help=('If set (s3://bucket/prefix), also upload the '
+                          'processed data to this S3-compatible bucket while '
+                          'it is being written. Requires boto3.'))
+parser.add_argument('--s3-endpoint-url', required=False, default=None,
+                    dest='s3_endpoint_url',
+                    help='Endpoint URL of a non-AWS S3-compatible service (e.g. MinIO).')
+parser.add_argument('-s', '--statistics', required=False, default=None,
+                    help=('Path to a NetCDF4 file of normalisation statistics '
+                          '(see compute_statistics.py). If set, the processed '
+                          'data is standardised with them.'))
 
 args = parser.parse_args()
 
@@ -43,6 +71,8 @@ logging.basicConfig(
 SOURCES = ['ifs', 'era5']
 RAW_SUFFIX = '_raw' # for the naming of the folders containing unprocessed data
 
+cache_folder = args.cache_folder or os.path.join(args.target_folder, 'cache')
+
 ifs_datetime = None
 
 if not args.skip_download:
@@ -52,7 +82,7 @@ if not args.skip_download:
         if not os.path.exists(target):
             os.makedirs(target)
         data_source = importlib.import_module(f'data_sources.{source}')
-        datetime = data_source.download_latest(target)
+        datetime = data_source.download_latest(target, cache_folder)
         logger.info(f'Successfuly downloaded data from timestamp {datetime}')
         if source == 'ifs':
             ifs_datetime = datetime
@@ -73,7 +103,11 @@ if not args.skip_processing:
         os.path.join(args.target_folder, f'era5{RAW_SUFFIX}'),
         os.path.join(args.target_folder, f'ifs{RAW_SUFFIX}'),
         toa_radiation,
-        os.path.join(args.target_folder, 'processed')
+        os.path.join(args.target_folder, 'processed'),
+        args.statistics,
+        not args.no_deduplication,
+        args.s3_url,
+        args.s3_endpoint_url
     )
 else:
     logger.info('Skipping the processing step')
@@ -82,6 +116,16 @@ if args.cleanup:
     logger.info('Removing raw data folders')
     for source in SOURCES:
         shutil.rmtree(os.path.join(args.target_folder, f'{source}{RAW_SUFFIX}'))
+    # The raw folders only hold hardlinks to the cache. A cache folder given
+    # explicitly may be shared with other runs, so it is left alone. Entries
+    # are removed under their locks, as other runs on the same target folder
+    # may be using them.
+    if args.cache_folder is None:
+        logger.info('Emptying the download cache')
+        cache.evict(cache_folder, 0)
+
+if args.cache_max_age is not None:
+    cache.evict(cache_folder, args.cache_max_age * 3600)
         
 if not args.skip_processing:
     logger.info(f'Done! Processed data is available in {os.path.join(args.target_folder, 'processed')}')
@@ -1,2 +1,3 @@
 from .process_data import process_data as process_data
-from .process_data import latest_datetime as latest_datetime
\ No newline at end of file
+from .process_data import latest_datetime as latest_datetime
+from .normalization import compute_statistics as compute_statistics
\ No newline at end of file
@@ -0,0 +1,90 @@
+import os
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import zarr
+
+class DeduplicatingStore(zarr.storage.DirectoryStore):
+    '''
+    A zarr directory store in which chunks are content-addressed: each chunk is
+    written once to `objects_path`, under the hash of its encoded bytes, and the
+    store only holds hardlinks to these objects.
+
+    Consecutive processed stores share many identical chunks (the context
+    variables, and the ERA5 sea surface temperature as long as ERA5 has not
+    moved on), which are then neither written again nor take more disk space.
+    If `objects_path` is on another filesystem, chunks are copied instead.
+
+    Objects no longer referenced by any store are removed by `prune`.
+    '''
+    def __init__(self, path: str, objects_path: str, **kwargs):
+        super().__init__(path, **kwargs)
+        self.objects_path = objects_path
+        self.written = 0
+        self.reused = 0
+
+    def _tofile(self, a, fn):
+        # Called by DirectoryStore.__setitem__ with a temporary path, which is
+        # then moved into place.
+        if os.path.basename(fn).startswith('.z'): # metadata
+            return super()._tofile(a, fn)
+
+        data = memoryview(a).cast('B')
+        digest = hashlib.sha256(data).hexdigest()
+        obj = os.path.join(self.objects_path, digest[:2], digest[2:])
+
+        if os.path.exists(obj):
+            self.reused += 1
+        else:
+            os.makedirs(os.path.dirname(obj), exist_ok=True)
+            tmp = f'{obj}.{uuid.uuid4().hex}.partial'
+            super()._tofile(a, tmp)
+            os.replace(tmp, obj)
+            self.written += 1
+
+        try:
+            os.link(obj, fn)
+        except FileNotFoundError: # pruned in the meantime
+            super()._tofile(a, fn)
+        except OSError:
+            shutil.copyfile(obj, fn)
+
+def prune(objects_path: str, partial_max_age: float = 3600) -> int:
+    '''
+    Remove the objects of a `DeduplicatingStore` that are not linked from any
+    store anymore, and the partial objects left behind by writers interrupted
+    more than `partial_max_age` seconds ago (younger ones may still be being
+    written by a concurrent run).
+
+    Returns:
+        int: The number of removed objects.
+    '''
+    logger = logging.getLogger(__name__)
+    if not os.path.exists(objects_path):
+        return 0
+
+    cutoff = time.time() - partial_max_age
+    removed = 0
+    for prefix in os.listdir(objects_path):
+        prefix_path = os.path.join(objects_path, prefix)
+        for name in os.listdir(prefix_path):
+            path = os.path.join(prefix_path, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError: # renamed into place or pruned meanwhile
+                continue
+            if name.endswith('.partial'):
+                if stat.st_mtime >= cutoff:
+                    continue
+            elif stat.st_nlink != 1:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            removed += 1
+    if removed:
+        logger.info(f'Removed {removed} unreferenced chunks from {objects_path}')
+    return removed
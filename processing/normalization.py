@@ -0,0 +1,148 @@
+import os
+import logging
+import numpy as np
+import xarray as xr
+
+STATISTICS = ['mean', 'std']
+NORMALISED_ATTR = 'normalised' # set on stores and variables written normalised
+
+def compute_statistics(processed_folder: str, target_path: str) -> None:
+    '''
+    Compute the per-variable, per-level mean and standard deviation over an
+    archive of processed zarr stores, and save them as a NetCDF4 file that can
+    be given to `process_data` to normalise its output.
+
+    The statistics are computed in a single streaming pass: every store is read
+    once, reduced to a (count, mean, M2) triple per level and merged into the
+    running totals (Welford's algorithm, in its batched form). Only one store is
+    held in memory at a time. NaNs (e.g. the sea surface temperature over land)
+    are ignored.
+
+    Stores written normalised (marked with the `normalised` attribute) are
+    skipped.
+
+    Parameters:
+        processed_folder (str): Folder containing the `{dt}.zarr` stores.
+        target_path (str): Path of the NetCDF4 file to write.
+    '''
+    logger = logging.getLogger(__name__)
+
+    stores = sorted(f for f in os.listdir(processed_folder) if f.endswith('.zarr'))
+    if not stores:
+        raise FileNotFoundError(f'No zarr store found in {processed_folder}')
+
+    running = {} # var -> (count, mean, M2), each an array over levels
+    levels = {}  # var -> level coordinate, if any
+    skipped = 0
+
+    for store in stores:
+        logger.info(f'Accumulating statistics from {store}')
+        ds = xr.open_zarr(os.path.join(processed_folder, store))
+        if ds.attrs.get(NORMALISED_ATTR):
+            logger.warning(f'Skipping {store}, which is already normalised')
+            skipped += 1
+            ds.close()
+            continue
+        for var in ds.data_vars:
+            da = ds[var]
+            if 'level' in da.dims:
+                levels[var] = da.level.values
+                da = da.transpose('level', ...)
+                values = da.values.reshape(da.sizes['level'], -1)
+            else:
+                values = da.values.reshape(1, -1)
+            batch = _batch_moments(values)
+            running[var] = _merge_moments(running[var], batch) if var in running else batch
+        ds.close()
+
+    if not running:
+        raise ValueError(f'All the zarr stores in {processed_folder} are normalised')
+
+    stats = xr.Dataset()
+    for var, (count, mean, m2) in running.items():
+        std = np.sqrt(m2 / np.maximum(count, 1))
+        values = np.stack([mean, std]).astype('float32')
+        if var in levels:
+            stats[var] = xr.DataArray(
+                values,
+                dims=('statistic', 'level'),
+                coords={'statistic': STATISTICS, 'level': levels[var]}
+            )
+        else:
+            stats[var] = xr.DataArray(
+                values[:, 0],
+                dims=('statistic',),
+                coords={'statistic': STATISTICS}
+            )
+    stats.attrs = {'n_stores': len(stores) - skipped}
+
+    target_folder = os.path.dirname(target_path)
+    if target_folder and not os.path.exists(target_folder):
+        os.makedirs(target_folder)
+    logger.info(f'Saving statistics to {target_path}')
+    stats.to_netcdf(target_path)
+
+def load_statistics(path: str) -> xr.Dataset:
+    '''
+    Load statistics written by `compute_statistics` in memory.
+    '''
+    return xr.load_dataset(path, engine='netcdf4')
+
+def normalize(da: xr.DataArray, statistics: xr.Dataset) -> np.ndarray:
+    '''
+    Standardise `da` with the mean and std of the variable of the same name in
+    `statistics`, and cast it to float32.
+
+    The cast and the standardisation are done in a single float32 buffer, so
+    that only one copy of the data is made. A null std (e.g. a constant field)
+    is replaced by 1, so that no inf or NaN is written.
+
+    Returns:
+        np.ndarray: The standardised values, with the same dimensions as `da`.
+    '''
+    stats = statistics[da.name]
+    values = da.values.astype('float32') # the only copy
+    np.subtract(values, _broadcastable(stats.sel(statistic='mean'), da), out=values)
+    std = _broadcastable(stats.sel(statistic='std'), da)
+    np.divide(values, np.where(std > 0, std, np.float32(1)), out=values)
+    return values
+
+def normalised_attrs(attrs: dict) -> dict:
+    '''
+    Attributes of a normalised variable: the physical units no longer apply.
+    '''
+    return {**attrs, 'units': '1', NORMALISED_ATTR: 1}
+
+def _broadcastable(stat: xr.DataArray, da: xr.DataArray) -> np.ndarray:
+    '''
+    Reshape a statistic so that it broadcasts against the raw values of `da`.
+    '''
+    if 'level' not in stat.dims:
+        return np.float32(stat.values)
+    stat = stat.sel(level=da.level.values)
+    shape = [da.sizes['level'] if d == 'level' else 1 for d in da.dims]
+    return stat.values.astype('float32').reshape(shape)
+
+def _batch_moments(values: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Count, mean and sum of squared deviations of each row of `values`.
+    '''
+    values = values.astype('float64')
+    count = np.sum(~np.isnan(values), axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.nansum(values, axis=1) / count
+    m2 = np.nansum((values - mean[:, None]) ** 2, axis=1)
+    return count, np.nan_to_num(mean), m2
+
+def _merge_moments(a: tuple, b: tuple) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Merge two (count, mean, M2) triples (Chan et al. parallel update).
+    '''
+    count_a, mean_a, m2_a = a
+    count_b, mean_b, m2_b = b
+    count = count_a + count_b
+    safe_count = np.maximum(count, 1)
+    delta = mean_b - mean_a
+    mean = mean_a + delta * count_b / safe_count
+    m2 = m2_a + m2_b + delta ** 2 * count_a * count_b / safe_count
+    return count, mean, m2
@@ -3,20 +3,42 @@ import xarray as xr
 from datetime import datetime, timezone
 import logging
 from . import shift_longitude
+from . import normalization
+from . import chunk_store
 from pathlib import Path
 import re
 import numpy as np
+import zarr
 
 CTX_VARIABLES_PATH = Path(__file__).resolve().parent.parent / "ctx_variables.nc"
+LATEST_POINTER = 'LATEST' # file naming the latest complete store
+CHUNK_OBJECTS_FOLDER = '.chunks' # content-addressed chunks shared by the stores
 
 def process_data(era5_data_folder: str, 
                  ifs_data_folder: str,
                  toa_solar_radiation: xr.DataArray,
-                 target_folder: str) -> None:
+                 target_folder: str,
+                 statistics_path: str | None = None,
+                 deduplicate: bool = True,
+                 s3_url: str | None = None,
+                 s3_endpoint_url: str | None = None) -> None:
     '''
     Imports the latest data from IFS, the latest data from ERA5, and concatenates
     them so that the latest ERA5 sea surface temperature is given along with the
     rest. Makes everything into a zarr file ready to be sent for inference.
+
+    If `statistics_path` is given (see `normalization.compute_statistics`),
+    every variable it contains is standardised with its per-level mean and std
+    and cast to float32 while being written, so that the inference side does not
+    have to do it.
+
+    If `deduplicate` is set, chunks identical to those of previous stores are
+    hardlinked instead of being written again (see `chunk_store`).
+
+    If `s3_url` (`s3://bucket/prefix`) is given, the store is also uploaded to
+    that S3-compatible bucket while being written (see `s3_publish`), along with
+    a `LATEST` pointer once it is complete. `s3_endpoint_url` can point to a
+    non-AWS service (e.g. MinIO). This requires boto3.
     '''
     logger = logging.getLogger(__name__)
     
@@ -96,8 +118,24 @@ def process_data(era5_data_folder: str,
         latitude=ds.latitude.astype('float32')
     )
     
+    statistics = None
+    if statistics_path is not None:
+        logger.info(f'Normalising with the statistics from {statistics_path}')
+        statistics = normalization.load_statistics(statistics_path)
+
     # Assign the time variable to all variables
     for var in ds.data_vars:
+        if statistics is not None and var in statistics:
+            # Normalise, cast and add the time dimension in one go: the new
+            # axis is a view on the normalised buffer, so no extra copy is made.
+            da = ds[var]
+            ds[var] = xr.DataArray(
+                normalization.normalize(da, statistics)[np.newaxis],
+                dims=('time', *da.dims),
+                coords={**da.coords, 'time': [dt_np]},
+                attrs=normalization.normalised_attrs(da.attrs)
+            )
+            continue
         ds[var] = ds[var].expand_dims(time=[dt_np])
         ds[var] = ds[var].transpose('time', ...) # puts time first
 
@@ -114,13 +152,60 @@ def process_data(era5_data_folder: str,
     target_path = os.path.join(target_folder, f'{dt_str}.zarr')
     
     ds.attrs = {}
+    if statistics is not None:
+        # Lets compute_statistics tell these stores apart from raw ones
+        ds.attrs = {
+            normalization.NORMALISED_ATTR: 1,
+            'normalisation_statistics': os.path.abspath(statistics_path)
+        }
     
     # Save to file
     logger.info(f'Saving to {target_path}')
     if not os.path.exists(target_folder):
         os.makedirs(target_folder)
         
-    ds.to_zarr(target_path, mode='w', zarr_version=2, consolidated=True)
+    if deduplicate:
+        objects_path = os.path.join(target_folder, CHUNK_OBJECTS_FOLDER)
+        store = chunk_store.DeduplicatingStore(target_path, objects_path)
+    else:
+        store = zarr.storage.DirectoryStore(target_path)
+
+    publisher = None
+    if s3_url is not None:
+        # Optional dependency (boto3), only imported when publishing
+        from . import s3_publish
+        logger.info(f'Publishing to {s3_url} while writing')
+        publisher = s3_publish.S3Publisher(s3_url, s3_endpoint_url)
+        # When republishing a cycle, its store is deleted first: LATEST must
+        # not point to it until it is complete again.
+        publisher.retract(LATEST_POINTER, f'{dt_str}.zarr')
+        zarr_store = s3_publish.PublishingStore(store, publisher, f'{dt_str}.zarr')
+    else:
+        zarr_store = store
+
+    try:
+        ds.to_zarr(zarr_store, mode='w', zarr_version=2, consolidated=True)
+    except BaseException:
+        if publisher is not None:
+            # Stop uploading chunks and delete those already uploaded; the
+            # metadata is never uploaded, so the partial store stays invisible.
+            publisher.abort()
+        raise
+    if deduplicate:
+        logger.info(f'Wrote {store.written} new chunks, reused {store.reused}')
+        # Rewriting a store with the same timestamp may have unreferenced chunks
+        chunk_store.prune(objects_path)
+
+    # Point consumers (see serving.chunk_server) to the new store. Replacing the
+    # pointer is atomic, so they switch from one complete store to the next.
+    pointer_path = os.path.join(target_folder, LATEST_POINTER)
+    with open(f'{pointer_path}.tmp', 'w') as f:
+        f.write(f'{dt_str}.zarr')
+    os.replace(f'{pointer_path}.tmp', pointer_path)
+
+    if publisher is not None:
+        publisher.close()
+        publisher.upload(LATEST_POINTER, f'{dt_str}.zarr'.encode())
 
 def latest_datetime(ifs_data_folder : str) -> datetime:
     path_pressure = _get_latest_ifs(ifs_data_folder)[0]
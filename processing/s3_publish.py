@@ -0,0 +1,200 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import zarr
+from numcodecs.compat import ensure_bytes
+import boto3
+from boto3.s3.transfer import TransferConfig
+from io import BytesIO
+
+METADATA_KEYS = ('.zarray', '.zgroup', '.zattrs')
+CONSOLIDATED_KEY = '.zmetadata'
+
+class S3Publisher:
+    '''
+    Uploads the objects of a zarr store to an S3-compatible bucket, concurrently
+    and while the store is being written.
+
+    Chunks are uploaded as soon as they are given. Metadata is held back until
+    `close`, which waits for every chunk, uploads the metadata, and uploads the
+    consolidated metadata last: consumers opening the store with consolidated
+    metadata never see it partially uploaded. Large objects are uploaded in
+    parallel multipart, and failed uploads are retried with exponential backoff.
+    At most twice `max_workers` chunks are queued at a time: `put` blocks
+    beyond that, so that a slow bucket does not buffer the whole store in memory.
+
+    Credentials are read from the environment as usual for boto3
+    (AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY).
+    '''
+    def __init__(self, url: str, endpoint_url: str | None = None,
+                 max_workers: int = 16, max_attempts: int = 5):
+        '''
+        Parameters:
+            url (str): Destination folder, as `s3://bucket/prefix`.
+            endpoint_url (str | None): Endpoint of a non-AWS S3-compatible
+                service (e.g. MinIO).
+            max_workers (int): Number of concurrent uploads.
+            max_attempts (int): Number of attempts per object.
+        '''
+        parsed = urlparse(url)
+        if parsed.scheme != 's3' or not parsed.netloc:
+            raise ValueError(f'Invalid S3 URL: {url}. Use s3://bucket/prefix.')
+        self.bucket = parsed.netloc
+        self.prefix = parsed.path.strip('/')
+        self.max_attempts = max_attempts
+        self._client = boto3.client('s3', endpoint_url=endpoint_url)
+        self._transfer_config = TransferConfig(
+            multipart_threshold=8 * 1024 ** 2,
+            multipart_chunksize=8 * 1024 ** 2,
+            max_concurrency=4
+        )
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._in_flight = threading.BoundedSemaphore(2 * max_workers)
+        self._aborted = threading.Event()
+        self._futures = []
+        self._metadata = {}
+        self._lock = threading.Lock()
+        self._uploaded_keys = []
+        self.uploaded = 0
+
+    def put(self, key: str, data: bytes) -> None:
+        '''
+        Upload `data` under `key` (relative to the prefix). Metadata keys are
+        only uploaded on `close`.
+        '''
+        if key.rsplit('/', 1)[-1] in METADATA_KEYS + (CONSOLIDATED_KEY,):
+            with self._lock:
+                self._metadata[key] = data
+            return
+        self._in_flight.acquire()
+        try:
+            future = self._executor.submit(self._upload, key, data)
+        except BaseException:
+            self._in_flight.release()
+            raise
+        future.add_done_callback(lambda _: self._in_flight.release())
+        with self._lock:
+            self._futures.append(future)
+
+    def delete(self, key: str) -> None:
+        '''
+        Delete every object under `key` (relative to the prefix), the
+        consolidated metadata first, so that the store disappears before its
+        chunks do.
+        '''
+        prefix = self._object_key(key.strip('/'))
+        consolidated = f'{prefix}/{CONSOLIDATED_KEY}' if prefix else CONSOLIDATED_KEY
+        self._client.delete_object(Bucket=self.bucket, Key=consolidated)
+
+        paginator = self._client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket,
+                                       Prefix=f'{prefix}/' if prefix else ''):
+            self._delete_objects([o['Key'] for o in page.get('Contents', [])])
+
+    def retract(self, pointer: str, name: str) -> None:
+        '''
+        Delete the `pointer` object (e.g. `LATEST`) if it names `name`, so that
+        it does not point to a store that is about to be republished.
+        '''
+        key = self._object_key(pointer)
+        try:
+            current = self._client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+        except self._client.exceptions.NoSuchKey:
+            return
+        if current.decode().strip() == name:
+            self._client.delete_object(Bucket=self.bucket, Key=key)
+
+    def abort(self) -> None:
+        '''
+        Cancel the queued uploads without uploading any metadata, and delete
+        the chunks already uploaded. Running uploads are not retried.
+        '''
+        self._aborted.set()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._delete_objects([self._object_key(key) for key in self._uploaded_keys])
+
+    def close(self) -> None:
+        '''
+        Wait for all chunks, then upload the metadata, consolidated metadata
+        last. Raises the first upload error, if any.
+        '''
+        logger = logging.getLogger(__name__)
+        try:
+            for future in self._futures:
+                future.result()
+            consolidated = {key: data for key, data in self._metadata.items()
+                            if key.rsplit('/', 1)[-1] == CONSOLIDATED_KEY}
+            for future in [self._executor.submit(self._upload, key, data)
+                           for key, data in self._metadata.items()
+                           if key not in consolidated]:
+                future.result()
+            for key, data in consolidated.items():
+                self._upload(key, data)
+        finally:
+            self._executor.shutdown(cancel_futures=True)
+        logger.info(f'Uploaded {self.uploaded} objects to s3://{self.bucket}/{self.prefix}')
+
+    def upload(self, key: str, data: bytes) -> None:
+        '''
+        Upload a single object immediately, with retries.
+        '''
+        self._upload(key, data)
+
+    def _object_key(self, key: str) -> str:
+        return '/'.join(p for p in (self.prefix, key) if p)
+
+    def _delete_objects(self, keys: list[str]) -> None:
+        for i in range(0, len(keys), 1000): # the limit of delete_objects
+            objects = [{'Key': key} for key in keys[i:i + 1000]]
+            self._client.delete_objects(Bucket=self.bucket,
+                                        Delete={'Objects': objects, 'Quiet': True})
+
+    def _upload(self, key: str, data: bytes) -> None:
+        logger = logging.getLogger(__name__)
+        object_key = self._object_key(key)
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self._client.upload_fileobj(BytesIO(data), self.bucket, object_key,
+                                            Config=self._transfer_config)
+                break
+            except Exception as e:
+                if attempt == self.max_attempts or self._aborted.is_set():
+                    raise
+                delay = 2 ** (attempt - 1)
+                logger.warning(f'Upload of {object_key} failed ({e}), retrying in {delay}s')
+                time.sleep(delay)
+        with self._lock:
+            self._uploaded_keys.append(key)
+            self.uploaded += 1
+
+class PublishingStore(zarr.storage.KVStore):
+    '''
+    A zarr store that writes to an underlying store and, at the same time,
+    hands the same bytes to an `S3Publisher`, so that nothing has to be read
+    back from disk to be published.
+    '''
+    def __init__(self, store: zarr.storage.BaseStore, publisher: S3Publisher, name: str):
+        '''
+        Parameters:
+            store (zarr.storage.BaseStore): The underlying store.
+            publisher (S3Publisher): The publisher to upload with.
+            name (str): Name of the store in the destination folder.
+        '''
+        super().__init__(store)
+        self.publisher = publisher
+        self.name = name
+
+    def __setitem__(self, key, value):
+        self._mutable_mapping[key] = value
+        self.publisher.put(f'{self.name}/{key}', ensure_bytes(value))
+
+    def rmdir(self, path: str = '') -> None:
+        # Also called when the store is opened with mode='w': remove what a
+        # previous publication of the same store left in the bucket.
+        zarr.storage.rmdir(self._mutable_mapping, path)
+        self.publisher.delete(f'{self.name}/{path}')
+
+    def listdir(self, path: str = '') -> list[str]:
+        return zarr.storage.listdir(self._mutable_mapping, path)
@@ -0,0 +1,32 @@
+import argparse
+import logging
+import os
+import serving
+
+parser = argparse.ArgumentParser(
+    description=('Serve the processed zarr stores over HTTP, by timestamp '
+                 '(/{dt}.zarr/...). /latest returns the name of the latest store.'))
+parser.add_argument('-t', '--target-folder',
+                    required=False, default='./data',
+                    dest='target_folder',
+                    help='Target folder of main.py, containing the "processed" folder.')
+parser.add_argument('--host', required=False, default='127.0.0.1',
+                    help='Address to bind to.')
+parser.add_argument('-p', '--port', type=int, required=False, default=8000,
+                    help='Port to listen on.')
+parser.add_argument('--cache-size', type=int, required=False, default=1024,
+                    dest='cache_size',
+                    help='Size of the in-memory cache of decompressed chunks, in MB.')
+
+args = parser.parse_args()
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s %(levelname)s %(message)s',
+    force=True
+)
+
+serving.serve(os.path.join(args.target_folder, 'processed'),
+              args.host,
+              args.port,
+              args.cache_size * 1024 ** 2)
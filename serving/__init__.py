@@ -0,0 +1,2 @@
+from .chunk_server import serve as serve
+from .chunk_server import ChunkServer as ChunkServer
\ No newline at end of file
@@ -0,0 +1,290 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote
+import numcodecs
+from numcodecs.compat import ensure_bytes
+from processing.process_data import LATEST_POINTER
+
+METADATA_KEYS = ('.zmetadata', '.zarray', '.zgroup', '.zattrs')
+STORE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z(\.zarr)?$')
+
+class ChunkCache:
+    '''
+    Thread-safe LRU of served objects (decompressed chunks and rewritten
+    metadata), bounded by the total number of bytes held.
+    '''
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> tuple[bytes, str] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: tuple, data: bytes, etag: str) -> None:
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key)[0])
+            self._entries[key] = (data, etag)
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+class ChunkServer(ThreadingHTTPServer):
+    '''
+    Serves the processed zarr stores of `processed_folder` over HTTP, following
+    the zarr v2 HTTP layout:
+        /{dt}.zarr/{key} or /{dt}/{key} for a given cycle,
+        /latest returns the name of the latest complete store.
+
+    Chunks are decompressed once and kept in an LRU cache; the metadata served
+    declares no compressor and no filters, so that clients only need to read the
+    raw bytes. The latest cycle is read from the `LATEST` pointer that
+    `process_data` replaces atomically once a store is fully written.
+
+    Clients resolve `/latest` once and then open the store it names: a store
+    read through a moving `latest` path could mix the metadata of one cycle
+    with the chunks of the next.
+    '''
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], processed_folder: str,
+                 cache_bytes: int = 1024 ** 3):
+        super().__init__(address, _ChunkRequestHandler)
+        self.processed_folder = processed_folder
+        self.cache = ChunkCache(cache_bytes)
+        self._latest = None
+        self._latest_mtime = None
+        self._latest_lock = threading.Lock()
+
+    def latest_store(self) -> str | None:
+        '''
+        Name of the latest complete store. Re-read only when the pointer changes.
+        '''
+        pointer = os.path.join(self.processed_folder, LATEST_POINTER)
+        try:
+            mtime = os.stat(pointer).st_mtime_ns
+        except FileNotFoundError:
+            # Stores written before the pointer existed: consolidated metadata
+            # is written last, so its presence marks a complete store.
+            stores = [f for f in os.listdir(self.processed_folder)
+                      if f.endswith('.zarr') and os.path.exists(
+                          os.path.join(self.processed_folder, f, '.zmetadata'))]
+            return max(stores) if stores else None
+        with self._latest_lock:
+            if mtime != self._latest_mtime:
+                with open(pointer) as f:
+                    self._latest = f.read().strip()
+                self._latest_mtime = mtime
+            return self._latest
+
+    def resolve(self, store: str) -> str | None:
+        '''
+        Map the first component of a request path to a store folder name.
+        '''
+        if not STORE_PATTERN.match(store):
+            return None
+        return store if store.endswith('.zarr') else f'{store}.zarr'
+
+    def read(self, store: str, key: str) -> tuple[bytes, str] | None:
+        '''
+        Get the bytes to serve for `key` in `store`, and their ETag.
+        Returns None if the key does not exist.
+        '''
+        store_path = os.path.join(self.processed_folder, store)
+        path = os.path.join(store_path, *key.split('/'))
+        try:
+            stat = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        # The modification time is part of the key, so a rewritten store is
+        # never served from stale cache entries.
+        cache_key = (store, key, stat.st_mtime_ns)
+        entry = self.cache.get(cache_key)
+        if entry is not None:
+            return entry
+
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        name = key.rsplit('/', 1)[-1]
+        if name == '.zmetadata':
+            data = _strip_codecs_from_consolidated(data)
+        elif name == '.zarray':
+            data = _strip_codecs(data)
+        elif name not in METADATA_KEYS:
+            meta = _array_metadata(store_path, key)
+            if meta is not None and _is_decodable(meta):
+                data = _decode_chunk(data, meta)
+
+        etag = f'"{hashlib.md5(data).hexdigest()}"'
+        self.cache.put(cache_key, data, etag)
+        return data, etag
+
+class _ChunkRequestHandler(BaseHTTPRequestHandler):
+    server: ChunkServer
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def log_message(self, format, *args):
+        logging.getLogger(__name__).debug(format % args)
+
+    def _serve(self, send_body: bool):
+        path = unquote(self.path.split('?', 1)[0]).strip('/')
+        if path == 'latest':
+            self._serve_latest(send_body)
+            return
+        store, _, key = path.partition('/')
+        store = self.server.resolve(store)
+        if store is None or not key or '..' in key.split('/'):
+            self.send_error(404)
+            return
+
+        entry = self.server.read(store, key)
+        if entry is None:
+            # Missing chunks are filled with the fill value by zarr.
+            self.send_error(404)
+            return
+        data, etag = entry
+
+        if etag in (t.strip() for t in self.headers.get('If-None-Match', '').split(',')):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        status = 200
+        start, end = 0, len(data)
+        range_header = self.headers.get('Range')
+        if range_header is not None:
+            byte_range = _parse_range(range_header, len(data))
+            if byte_range is None:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(data)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+            start, end = byte_range
+
+        self.send_response(status)
+        self.send_header('Content-Type', _content_type(key))
+        self.send_header('Content-Length', str(end - start))
+        self.send_header('ETag', etag)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('X-Zarr-Store', store)
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end - 1}/{len(data)}')
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data[start:end])
+
+    def _serve_latest(self, send_body: bool):
+        store = self.server.latest_store()
+        if store is None:
+            self.send_error(404, 'No complete store yet')
+            return
+        data = store.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+
+def serve(processed_folder: str, host: str = '127.0.0.1', port: int = 8000,
+          cache_bytes: int = 1024 ** 3) -> None:
+    '''
+    Serve `processed_folder` until interrupted. See `ChunkServer`.
+    '''
+    logger = logging.getLogger(__name__)
+    with ChunkServer((host, port), processed_folder, cache_bytes) as server:
+        logger.info(f'Serving {processed_folder} on http://{host}:{server.server_port}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logger.info('Shutting down')
+
+def _parse_range(header: str, size: int) -> tuple[int, int] | None:
+    '''
+    Parse a single-range `bytes=` header into a [start, end) pair. Returns None
+    if the range is invalid or unsatisfiable.
+    '''
+    match = re.fullmatch(r'\s*bytes=(\d*)-(\d*)\s*', header)
+    if match is None or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        start, end = max(size - int(last), 0), size # suffix range
+    else:
+        start = int(first)
+        end = size if last == '' else min(int(last) + 1, size)
+    if start >= end:
+        return None
+    return start, end
+
+def _content_type(key: str) -> str:
+    if key.rsplit('/', 1)[-1] in METADATA_KEYS:
+        return 'application/json'
+    return 'application/octet-stream'
+
+def _array_metadata(store_path: str, key: str) -> dict | None:
+    '''
+    Metadata of the array containing the chunk `key` (works with both '.' and
+    '/' dimension separators).
+    '''
+    parts = key.split('/')
+    for i in range(len(parts) - 1, 0, -1):
+        zarray = os.path.join(store_path, *parts[:i], '.zarray')
+        if os.path.isfile(zarray):
+            with open(zarray) as f:
+                return json.load(f)
+    return None
+
+def _is_decodable(meta: dict) -> bool:
+    # Object arrays (e.g. strings) need their filters to be decoded by the client.
+    return meta.get('dtype') != '|O' and bool(meta.get('compressor') or meta.get('filters'))
+
+def _decode_chunk(data: bytes, meta: dict) -> bytes:
+    if meta.get('compressor'):
+        data = numcodecs.get_codec(meta['compressor']).decode(data)
+    for codec in reversed(meta.get('filters') or []):
+        data = numcodecs.get_codec(codec).decode(data)
+    return ensure_bytes(data)
+
+def _strip_codecs(zarray: bytes) -> bytes:
+    meta = json.loads(zarray)
+    if _is_decodable(meta):
+        meta['compressor'] = None
+        meta['filters'] = None
+    return json.dumps(meta, indent=4, sort_keys=True).encode()
+
+def _strip_codecs_from_consolidated(zmetadata: bytes) -> bytes:
+    consolidated = json.loads(zmetadata)
+    for key, meta in consolidated['metadata'].items():
+        if key.rsplit('/', 1)[-1] == '.zarray' and _is_decodable(meta):
+            meta['compressor'] = None
+            meta['filters'] = None
+    return json.dumps(consolidated, indent=4, sort_keys=True).encode()
@@ -0,0 +1,82 @@
+import os
+import time
+import threading
+from datetime import datetime
+from multiprocessing import Pool
+from data_sources import cache
+
+DT = datetime(2025, 1, 1)
+
+def _write(folder: str, content: str = 'data'):
+    with open(os.path.join(folder, 'a.nc'), 'w') as f:
+        f.write(content)
+
+def _fetch_in_process(args: tuple) -> list[str]:
+    cache_folder, counter, target = args
+    def download(folder: str):
+        with open(counter, 'a') as f:
+            f.write('x')
+        time.sleep(0.5)
+        _write(folder)
+    return cache.fetch(cache_folder, 'era5', {'v': [1]}, DT, download, target)
+
+def test_concurrent_processes_download_once(tmp_path):
+    counter = str(tmp_path / 'counter')
+    jobs = [(str(tmp_path / 'cache'), counter, str(tmp_path / f't{i}')) for i in range(4)]
+    with Pool(4) as pool:
+        paths = pool.map(_fetch_in_process, jobs)
+    assert open(counter).read() == 'x'
+    for (path,) in paths:
+        assert open(path).read() == 'data'
+
+def test_evict_waits_for_fetch(tmp_path):
+    cache_folder = str(tmp_path / 'cache')
+    target = str(tmp_path / 'target')
+    started, release = threading.Event(), threading.Event()
+    def download(folder: str):
+        started.set()
+        release.wait(5)
+        _write(folder)
+
+    result = {}
+    fetching = threading.Thread(target=lambda: result.update(
+        paths=cache.fetch(cache_folder, 'ifs', {}, DT, download, target)))
+    fetching.start()
+    started.wait(5)
+    evicting = threading.Thread(target=cache.evict, args=(cache_folder, 0))
+    evicting.start()
+    time.sleep(0.2)
+    release.set()
+    fetching.join()
+    evicting.join()
+
+    # The files were linked before the entry was evicted, and stay valid
+    assert open(result['paths'][0]).read() == 'data'
+    assert os.listdir(os.path.join(cache_folder, 'ifs')) == []
+
+def test_evict_keeps_recent_entries(tmp_path):
+    cache_folder = str(tmp_path / 'cache')
+    for i in range(2):
+        cache.fetch(cache_folder, 'ifs', {'i': i}, DT, _write, str(tmp_path / 'target'))
+    old = os.path.join(cache_folder, 'ifs', cache._cache_key('ifs', {'i': 0}, DT))
+    marker = os.path.join(old, cache.COMPLETE_MARKER)
+    os.utime(marker, (time.time() - 7200,) * 2)
+
+    assert cache.evict(cache_folder, 3600) == 1
+    assert not os.path.exists(old)
+    assert not os.path.exists(f'{old}.lock')
+    assert len(os.listdir(os.path.join(cache_folder, 'ifs'))) == 2 # entry and its lock
+
+def test_fetch_after_evict_downloads_again(tmp_path):
+    cache_folder = str(tmp_path / 'cache')
+    calls = []
+    def download(folder: str):
+        calls.append(folder)
+        _write(folder, str(len(calls)))
+    target = str(tmp_path / 'target')
+
+    cache.fetch(cache_folder, 'ifs', {}, DT, download, target)
+    cache.evict(cache_folder, 0)
+    (path,) = cache.fetch(cache_folder, 'ifs', {}, DT, download, target)
+    assert len(calls) == 2
+    assert open(path).read() == '2'
@@ -0,0 +1,120 @@
+import os
+import threading
+import urllib.request
+from urllib.error import HTTPError
+import numpy as np
+import pytest
+import xarray as xr
+from serving import ChunkServer
+
+STORES = ['2025-01-01T00:00:00Z.zarr', '2025-01-01T06:00:00Z.zarr']
+
+def _dataset(offset: float) -> xr.Dataset:
+    return xr.Dataset({'t': (('x', 'y'), np.arange(64, dtype='float32').reshape(8, 8) + offset)})
+
+def _point_latest(folder: str, store: str):
+    pointer = os.path.join(folder, 'LATEST')
+    with open(f'{pointer}.tmp', 'w') as f:
+        f.write(store)
+    os.replace(f'{pointer}.tmp', pointer)
+
+@pytest.fixture
+def processed(tmp_path):
+    for i, store in enumerate(STORES):
+        _dataset(i).to_zarr(str(tmp_path / store), zarr_version=2, consolidated=True,
+                            encoding={'t': {'chunks': (2, 8)}})
+    _point_latest(str(tmp_path), STORES[0])
+    return tmp_path
+
+def _start(folder, cache_bytes: int = 1024 ** 2):
+    server = ChunkServer(('127.0.0.1', 0), str(folder), cache_bytes)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+@pytest.fixture
+def server(processed):
+    server, url = _start(processed)
+    yield server, url
+    server.shutdown()
+    server.server_close()
+
+def _get(url: str, **headers):
+    request = urllib.request.Request(url, headers=headers)
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.headers, response.read()
+    except HTTPError as e:
+        return e.code, e.headers, e.read()
+
+def test_open_zarr(server):
+    # zarr reads HTTP stores through fsspec
+    pytest.importorskip('fsspec')
+    pytest.importorskip('aiohttp')
+    _, url = server
+    store = _get(f'{url}/latest')[2].decode()
+    assert store == STORES[0]
+    ds = xr.open_zarr(f'{url}/{store}')
+    np.testing.assert_array_equal(ds.t.values, _dataset(0).t.values)
+    # Without the .zarr suffix, too
+    ds = xr.open_zarr(f'{url}/{STORES[1][:-len(".zarr")]}')
+    np.testing.assert_array_equal(ds.t.values, _dataset(1).t.values)
+
+def test_range(server):
+    _, url = server
+    status, _, data = _get(f'{url}/{STORES[0]}/t/0.0')
+    assert status == 200 and len(data) == 2 * 8 * 4 # served decompressed
+
+    status, headers, part = _get(f'{url}/{STORES[0]}/t/0.0', Range='bytes=4-11')
+    assert status == 206
+    assert part == data[4:12]
+    assert headers['Content-Range'] == f'bytes 4-11/{len(data)}'
+
+    status, _, part = _get(f'{url}/{STORES[0]}/t/0.0', Range='bytes=-4')
+    assert status == 206 and part == data[-4:]
+
+    status, _, _ = _get(f'{url}/{STORES[0]}/t/0.0', Range=f'bytes={len(data)}-')
+    assert status == 416
+
+def test_if_none_match(server):
+    _, url = server
+    status, headers, _ = _get(f'{url}/{STORES[0]}/t/0.0')
+    etag = headers['ETag']
+    status, _, data = _get(f'{url}/{STORES[0]}/t/0.0', **{'If-None-Match': etag})
+    assert status == 304 and data == b''
+    status, _, _ = _get(f'{url}/{STORES[0]}/t/1.0', **{'If-None-Match': etag})
+    assert status == 200
+
+def test_not_found(server, processed):
+    _, url = server
+    (processed / 'secret').write_text('secret')
+    assert _get(f'{url}/{STORES[0]}/../secret')[0] == 404
+    assert _get(f'{url}/{STORES[0]}/%2E%2E/secret')[0] == 404
+    assert _get(f'{url}/{STORES[0]}/t/9.0')[0] == 404
+    assert _get(f'{url}/other/t/0.0')[0] == 404
+    assert _get(f'{url}/latest/t/0.0')[0] == 404
+
+def test_latest_follows_pointer(server, processed):
+    _, url = server
+    assert _get(f'{url}/latest')[2].decode() == STORES[0]
+    _point_latest(str(processed), STORES[1])
+    # Make sure the mtime differs on filesystems with a coarse resolution
+    stat = os.stat(processed / 'LATEST')
+    os.utime(processed / 'LATEST', ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert _get(f'{url}/latest')[2].decode() == STORES[1]
+
+def test_cache_eviction(processed):
+    chunk_bytes = 2 * 8 * 4
+    server, url = _start(processed, cache_bytes=2 * chunk_bytes)
+    try:
+        for i in range(4):
+            _get(f'{url}/{STORES[0]}/t/{i}.0')
+        assert server.cache.size <= 2 * chunk_bytes
+        keys = [key[1] for key in server.cache._entries]
+        assert keys == ['t/2.0', 't/3.0']
+
+        _get(f'{url}/{STORES[0]}/t/2.0') # most recently used again
+        _get(f'{url}/{STORES[0]}/t/0.0')
+        assert [key[1] for key in server.cache._entries] == ['t/2.0', 't/0.0']
+    finally:
+        server.shutdown()
+        server.server_close()
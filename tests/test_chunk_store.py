@@ -0,0 +1,86 @@
+import os
+import time
+import numpy as np
+import xarray as xr
+from processing import chunk_store
+
+def _dataset(changing: np.ndarray) -> xr.Dataset:
+    return xr.Dataset({
+        'constant': (('x', 'y'), np.arange(64, dtype='float32').reshape(8, 8)),
+        'changing': (('x', 'y'), changing.astype('float32')),
+    })
+
+def _write(folder, name: str, ds: xr.Dataset) -> chunk_store.DeduplicatingStore:
+    store = chunk_store.DeduplicatingStore(str(folder / name), str(folder / '.chunks'))
+    ds.to_zarr(store, mode='w', zarr_version=2, consolidated=True,
+               encoding={v: {'chunks': (2, 8)} for v in ds.data_vars})
+    return store
+
+def _objects(folder) -> set[str]:
+    objects = set()
+    for root, _, files in os.walk(folder / '.chunks'):
+        objects.update(os.path.join(root, f) for f in files)
+    return objects
+
+def test_consecutive_stores_share_chunks(tmp_path):
+    first = _write(tmp_path, 'a.zarr', _dataset(np.zeros((8, 8)) + np.arange(8)[:, None]))
+    assert first.reused == 0
+    second = _write(tmp_path, 'b.zarr', _dataset(np.ones((8, 8)) + np.arange(8)[:, None]))
+    assert second.reused == 4 # the chunks of `constant`
+    assert second.written == 4
+
+    chunk = os.stat(tmp_path / 'b.zarr' / 'constant' / '0.0')
+    assert chunk.st_nlink == 3 # both stores and the object
+    for name in ('a.zarr', 'b.zarr'):
+        ds = xr.open_zarr(tmp_path / name)
+        np.testing.assert_array_equal(ds.constant.values, _dataset(np.zeros((8, 8))).constant.values)
+
+def test_rewrite_prunes_orphans(tmp_path):
+    _write(tmp_path, 'a.zarr', _dataset(np.zeros((8, 8)) + np.arange(8)[:, None]))
+    _write(tmp_path, 'b.zarr', _dataset(np.zeros((8, 8)) + np.arange(8)[:, None]))
+    before = _objects(tmp_path)
+
+    # Rewrite `b` with new values: its previous chunks are also those of `a`,
+    # so none is orphaned
+    _write(tmp_path, 'b.zarr', _dataset(np.ones((8, 8))))
+    new = _objects(tmp_path) - before
+    assert chunk_store.prune(str(tmp_path / '.chunks')) == 0
+
+    # Rewrite `b` again: the objects only it referenced are orphaned
+    _write(tmp_path, 'b.zarr', _dataset(np.full((8, 8), 2)))
+    assert chunk_store.prune(str(tmp_path / '.chunks')) == len(new)
+    assert not new & _objects(tmp_path)
+    for path in _objects(tmp_path):
+        assert os.stat(path).st_nlink > 1
+
+    ds = xr.open_zarr(tmp_path / 'b.zarr')
+    np.testing.assert_array_equal(ds.changing.values, np.full((8, 8), 2))
+
+def test_prune_removes_stale_partials(tmp_path):
+    _write(tmp_path, 'a.zarr', _dataset(np.zeros((8, 8))))
+    prefix = os.path.dirname(next(iter(_objects(tmp_path))))
+    stale = os.path.join(prefix, 'abc.0.partial')
+    fresh = os.path.join(prefix, 'abc.1.partial')
+    for path in (stale, fresh):
+        open(path, 'w').close()
+    os.utime(stale, (time.time() - 7200,) * 2)
+
+    assert chunk_store.prune(str(tmp_path / '.chunks'), partial_max_age=3600) == 1
+    assert not os.path.exists(stale)
+    assert os.path.exists(fresh)
+
+def test_link_falls_back_when_object_pruned(tmp_path, monkeypatch):
+    link = os.link
+    def link_after_prune(src, dst):
+        # The object is pruned between the existence check and the link
+        os.remove(src)
+        link(src, dst)
+    monkeypatch.setattr(chunk_store.os, 'link', link_after_prune)
+
+    _write(tmp_path, 'a.zarr', _dataset(np.zeros((8, 8))))
+    # Every chunk was written in full instead
+    assert not _objects(tmp_path)
+    assert os.stat(tmp_path / 'a.zarr' / 'changing' / '0.0').st_nlink == 1
+    ds = xr.open_zarr(tmp_path / 'a.zarr')
+    np.testing.assert_array_equal(ds.constant.values, _dataset(np.zeros((8, 8))).constant.values)
+    np.testing.assert_array_equal(ds.changing.values, np.zeros((8, 8)))
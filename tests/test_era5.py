@@ -0,0 +1,120 @@
+import os
+import json
+import shutil
+import zipfile
+from datetime import datetime, timedelta, timezone
+import numpy as np
+import pandas as pd
+import pytest
+import xarray as xr
+from data_sources import era5
+
+class FakeResult:
+    def __init__(self, path: str):
+        self.path = path
+
+    def download(self, target: str):
+        shutil.copyfile(self.path, target)
+
+class FakeClient:
+    '''
+    Stands in for `cdsapi.Client`. Answers every request with a zip holding a
+    NetCDF file with one `valid_time` per requested timestamp. The archives are
+    built beforehand, as the netCDF library must not be used from the download
+    threads.
+    '''
+    def __init__(self, folder: str, datetimes: list[datetime]):
+        self.requests = []
+        self._archives = {}
+        for dataset in [era5.PRESSURE_DATASET, era5.SINGLE_DATASET]:
+            for request in era5.plan_requests(dataset, datetimes):
+                path = os.path.join(folder, f'{len(self._archives)}.zip')
+                _write_archive(path, _requested_times(request))
+                self._archives[json.dumps([dataset, request])] = path
+
+    def retrieve(self, dataset: str, request: dict) -> FakeResult:
+        self.requests.append((dataset, request))
+        return FakeResult(self._archives[json.dumps([dataset, request])])
+
+def _requested_times(request: dict) -> list[pd.Timestamp]:
+    return [
+        pd.Timestamp(f'{year}-{month:02d}-{day:02d}T{time}')
+        for year in request['year']
+        for month in request['month']
+        for day in request['day']
+        for time in request['time']
+    ]
+
+def _write_archive(path: str, times: list[pd.Timestamp]):
+    nc = f'{path}.nc'
+    xr.Dataset(
+        {'sst': (('valid_time', 'latitude'), np.array([[t.day, t.hour] for t in times], 'float32'))},
+        coords={'valid_time': times}
+    ).to_netcdf(nc)
+    with zipfile.ZipFile(path, 'w') as z:
+        z.write(nc, 'data_stream-oper_stepType-instant.nc')
+    os.remove(nc)
+
+@pytest.fixture
+def datetimes() -> list[datetime]:
+    # Every 6 hours for 40 days over two months, and a lone timestamp in a third
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    return ([start + timedelta(hours=6 * i) for i in range(4 * 40)]
+            + [datetime(2025, 3, 5, 12, tzinfo=timezone.utc)])
+
+def test_download_coalesces_and_splits(tmp_path, datetimes):
+    client = FakeClient(str(tmp_path), datetimes)
+    target = tmp_path / 'era5_raw'
+    era5.download(str(target), str(tmp_path / 'cache'), datetimes, client=client)
+
+    # One request per month and per dataset
+    assert len(client.requests) == 6
+
+    wanted = {pd.Timestamp(dt.replace(tzinfo=None)) for dt in datetimes}
+    fetched = [t for _, request in client.requests for t in _requested_times(request)]
+    assert set(fetched) == wanted
+    assert len(fetched) == 2 * len(wanted) # no timestamp requested twice
+
+    expected = sorted(f'{dt.strftime("%Y-%m-%dT%H:%M:%SZ")}-{suffix}.nc'
+                      for dt in datetimes for suffix in ['pressure', 'single'])
+    assert sorted(os.listdir(target)) == expected
+
+    ds = xr.open_dataset(target / '2025-01-02T06:00:00Z-single.nc')
+    assert ds.sizes['valid_time'] == 1
+    assert ds.valid_time.values[0] == np.datetime64('2025-01-02T06:00:00')
+    assert ds.sst.values.tolist() == [[2, 6]]
+    ds.close()
+
+def test_download_uses_cache(tmp_path, datetimes):
+    client = FakeClient(str(tmp_path), datetimes)
+    for _ in range(2):
+        era5.download(str(tmp_path / 'era5_raw'), str(tmp_path / 'cache'), datetimes, client=client)
+    assert len(client.requests) == 6
+
+def test_plan_requests_splits_by_days(monkeypatch, datetimes):
+    # 4 timestamps per day x 6 variables: 2 days fit in 50 fields. January
+    # has 31 days, February 9 and March 1.
+    monkeypatch.setitem(era5.MAX_FIELDS, era5.SINGLE_DATASET, 50)
+    requests = era5.plan_requests(era5.SINGLE_DATASET, datetimes)
+
+    assert [len(r['day']) for r in requests] == [2] * 15 + [1] + [2] * 4 + [1] + [1]
+    for request in requests:
+        fields = len(request['day']) * len(request['time']) * len(request['variable'])
+        assert fields <= 50
+    wanted = {pd.Timestamp(dt.replace(tzinfo=None)) for dt in datetimes}
+    assert {t for r in requests for t in _requested_times(r)} == wanted
+
+def test_plan_requests_groups_days_by_hours():
+    datetimes = [
+        datetime(2025, 1, 1, 0, tzinfo=timezone.utc),
+        datetime(2025, 1, 1, 12, tzinfo=timezone.utc),
+        datetime(2025, 1, 2, 0, tzinfo=timezone.utc),
+        datetime(2025, 1, 2, 12, tzinfo=timezone.utc),
+        datetime(2025, 1, 3, 6, tzinfo=timezone.utc),
+    ]
+    requests = era5.plan_requests(era5.PRESSURE_DATASET, datetimes)
+    assert [(r['day'], r['time']) for r in requests] == [
+        ([1, 2], ['00:00:00', '12:00:00']),
+        ([3], ['06:00:00']),
+    ]
+    assert all(r['pressure_level'] == era5.PRESSURE_LEVELS for r in requests)
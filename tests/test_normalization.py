@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+import xarray as xr
+from processing import normalization
+
+LEVELS = [1000, 850, 500]
+
+def _dataset(seed: int) -> xr.Dataset:
+    rng = np.random.default_rng(seed)
+    t = rng.normal(280, 10, (1, len(LEVELS), 4, 5))
+    sst = rng.normal(290, 5, (1, 4, 5))
+    sst[:, :2, :2] = np.nan # land
+    return xr.Dataset(
+        {
+            't': (('time', 'level', 'lat', 'lon'), t),
+            'sst': (('time', 'lat', 'lon'), sst),
+        },
+        coords={'level': LEVELS}
+    )
+
+def _write_stores(folder, count: int) -> list[xr.Dataset]:
+    datasets = [_dataset(i) for i in range(count)]
+    for i, ds in enumerate(datasets):
+        ds.to_zarr(str(folder / f'2025-01-01T{i:02d}:00:00Z.zarr'),
+                   zarr_version=2, consolidated=True)
+    return datasets
+
+def test_statistics_match_numpy(tmp_path):
+    datasets = _write_stores(tmp_path / 'processed', 4)
+    target = str(tmp_path / 'stats.nc')
+    normalization.compute_statistics(str(tmp_path / 'processed'), target)
+    stats = normalization.load_statistics(target)
+
+    t = np.concatenate([ds.t.values for ds in datasets])
+    np.testing.assert_allclose(stats.t.sel(statistic='mean'), t.mean(axis=(0, 2, 3)), rtol=1e-6)
+    np.testing.assert_allclose(stats.t.sel(statistic='std'), t.std(axis=(0, 2, 3)), rtol=1e-5)
+    np.testing.assert_array_equal(stats.level, LEVELS)
+
+    sst = np.concatenate([ds.sst.values for ds in datasets])
+    np.testing.assert_allclose(stats.sst.sel(statistic='mean'), np.nanmean(sst), rtol=1e-6)
+    np.testing.assert_allclose(stats.sst.sel(statistic='std'), np.nanstd(sst), rtol=1e-5)
+    assert stats.attrs['n_stores'] == 4
+
+def test_normalised_stores_are_skipped(tmp_path):
+    datasets = _write_stores(tmp_path / 'processed', 2)
+    normalised = _dataset(10) * 100
+    normalised.attrs = {normalization.NORMALISED_ATTR: 1}
+    normalised.to_zarr(str(tmp_path / 'processed' / '2025-01-02T00:00:00Z.zarr'),
+                       zarr_version=2, consolidated=True)
+
+    target = str(tmp_path / 'stats.nc')
+    normalization.compute_statistics(str(tmp_path / 'processed'), target)
+    stats = normalization.load_statistics(target)
+    t = np.concatenate([ds.t.values for ds in datasets])
+    np.testing.assert_allclose(stats.t.sel(statistic='mean'), t.mean(axis=(0, 2, 3)), rtol=1e-6)
+    assert stats.attrs['n_stores'] == 2
+
+def test_only_normalised_stores(tmp_path):
+    ds = _dataset(0)
+    ds.attrs = {normalization.NORMALISED_ATTR: 1}
+    ds.to_zarr(str(tmp_path / '2025-01-01T00:00:00Z.zarr'), zarr_version=2, consolidated=True)
+    with pytest.raises(ValueError):
+        normalization.compute_statistics(str(tmp_path), str(tmp_path / 'stats.nc'))
+
+def _statistics(mean: list[float], std: list[float]) -> xr.Dataset:
+    return xr.Dataset({'t': xr.DataArray(
+        np.array([mean, std], dtype='float32'),
+        dims=('statistic', 'level'),
+        coords={'statistic': normalization.STATISTICS, 'level': LEVELS}
+    )})
+
+def test_levels_are_matched_by_value():
+    statistics = _statistics([1, 2, 3], [10, 20, 30])
+    # Levels in another order, and level not the first dimension
+    da = xr.DataArray(
+        np.array([[[3, 1, 2]]], dtype='float64') * 11,
+        dims=('time', 'lat', 'level'),
+        coords={'level': [500, 1000, 850]},
+        name='t'
+    )
+    np.testing.assert_allclose(normalization.normalize(da, statistics),
+                               [[[1, 1, 1]]])
+
+def test_null_std_does_not_divide():
+    statistics = _statistics([1, 2, 3], [0, np.nan, 2])
+    da = xr.DataArray(
+        np.full((1, 3, 2), 5.0),
+        dims=('time', 'level', 'lat'),
+        coords={'level': LEVELS},
+        name='t'
+    )
+    values = normalization.normalize(da, statistics)
+    assert values.dtype == np.float32
+    np.testing.assert_allclose(values[0, :, 0], [4, 3, 1])
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+import xarray as xr
+import zarr
+
+boto3 = pytest.importorskip('boto3')
+moto_server = pytest.importorskip('moto.server')
+
+from processing import s3_publish
+
+BUCKET = 'bucket'
+
+@pytest.fixture(scope='module')
+def endpoint():
+    server = moto_server.ThreadedMotoServer(ip_address='127.0.0.1', port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f'http://{host}:{port}'
+    server.stop()
+
+@pytest.fixture
+def s3(endpoint, monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setattr(s3_publish.time, 'sleep', lambda _: None)
+    client = boto3.client('s3', endpoint_url=endpoint)
+    client.create_bucket(Bucket=BUCKET)
+    yield client
+    keys = _keys(client)
+    if keys:
+        client.delete_objects(Bucket=BUCKET, Delete={'Objects': [{'Key': k} for k in keys]})
+    client.delete_bucket(Bucket=BUCKET)
+
+def _keys(client) -> list[str]:
+    return sorted(o['Key'] for o in client.list_objects_v2(Bucket=BUCKET).get('Contents', []))
+
+def _dataset(size: int = 8) -> xr.Dataset:
+    return xr.Dataset({'t': (('x', 'y'), np.arange(size * 4, dtype='float32').reshape(size, 4))})
+
+def _publish(tmp_path, endpoint, ds, publisher=None):
+    publisher = publisher or s3_publish.S3Publisher(f's3://{BUCKET}/prefix', endpoint)
+    store = s3_publish.PublishingStore(
+        zarr.storage.DirectoryStore(str(tmp_path / 'a.zarr')), publisher, 'a.zarr')
+    ds.to_zarr(store, mode='w', zarr_version=2, consolidated=True,
+               encoding={'t': {'chunks': (2, 4)}})
+    return publisher
+
+def _record_uploads(publisher) -> list[str]:
+    uploads = []
+    upload_fileobj = publisher._client.upload_fileobj
+    def record(fileobj, bucket, key, **kwargs):
+        upload_fileobj(fileobj, bucket, key, **kwargs)
+        uploads.append(key)
+    publisher._client.upload_fileobj = record
+    return uploads
+
+def test_metadata_uploaded_last(tmp_path, endpoint, s3):
+    publisher = s3_publish.S3Publisher(f's3://{BUCKET}/prefix', endpoint)
+    uploads = _record_uploads(publisher)
+    _publish(tmp_path, endpoint, _dataset(), publisher)
+    # Nothing of the store is visible before `close`
+    assert not any(k.rsplit('/', 1)[-1].startswith('.z') for k in uploads)
+    publisher.close()
+
+    chunks = [f'prefix/a.zarr/t/{i}.0' for i in range(4)]
+    assert sorted(uploads[:4]) == chunks
+    assert uploads[-1] == 'prefix/a.zarr/.zmetadata'
+    assert sorted(uploads) == _keys(s3)
+
+def test_republish_removes_stale_chunks(tmp_path, endpoint, s3):
+    _publish(tmp_path, endpoint, _dataset(8)).close()
+    assert 'prefix/a.zarr/t/3.0' in _keys(s3)
+
+    publisher = s3_publish.S3Publisher(f's3://{BUCKET}/prefix', endpoint)
+    uploads = _record_uploads(publisher)
+    _publish(tmp_path, endpoint, _dataset(4), publisher)
+    # The previous store is gone before anything new is visible
+    assert 'prefix/a.zarr/.zmetadata' not in _keys(s3)
+    publisher.close()
+
+    keys = _keys(s3)
+    assert 'prefix/a.zarr/t/3.0' not in keys
+    assert keys == sorted(uploads)
+
+def test_retract_latest(tmp_path, endpoint, s3):
+    publisher = s3_publish.S3Publisher(f's3://{BUCKET}/prefix', endpoint)
+    publisher.upload('LATEST', b'a.zarr')
+    publisher.retract('LATEST', 'b.zarr')
+    assert 'prefix/LATEST' in _keys(s3)
+    publisher.retract('LATEST', 'a.zarr')
+    assert 'prefix/LATEST' not in _keys(s3)
+    publisher.retract('LATEST', 'a.zarr') # no pointer
+    publisher.close()
+
+def test_abort_leaves_nothing(tmp_path, endpoint, s3):
+    publisher = _publish(tmp_path, endpoint, _dataset())
+    publisher.abort()
+    assert _keys(s3) == []
+
+def test_retry_on_failure(tmp_path, endpoint, s3):
+    publisher = s3_publish.S3Publisher(f's3://{BUCKET}/prefix', endpoint, max_attempts=3)
+    failures = {}
+    upload_fileobj = publisher._client.upload_fileobj
+    def flaky(fileobj, bucket, key, **kwargs):
+        failures[key] = failures.get(key, 0) + 1
+        if failures[key] < 3:
+            raise ConnectionError('injected')
+        upload_fileobj(fileobj, bucket, key, **kwargs)
+    publisher._client.upload_fileobj = flaky
+
+    _publish(tmp_path, endpoint, _dataset(), publisher).close()
+    assert publisher.uploaded == len(_keys(s3))
+    assert set(failures.values()) == {3}
+
+def test_retries_exhausted(tmp_path, endpoint, s3):
+    publisher = s3_publish.S3Publisher(f's3://{BUCKET}/prefix', endpoint, max_attempts=2)
+    def failing(fileobj, bucket, key, **kwargs):
+        raise ConnectionError('injected')
+    publisher._client.upload_fileobj = failing
+
+    _publish(tmp_path, endpoint, _dataset(), publisher)
+    with pytest.raises(ConnectionError):
+        publisher.close()
+    assert _keys(s3) == []